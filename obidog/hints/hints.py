@@ -1,3 +1,4 @@
+import functools
 import glob
 import os
 import re
@@ -5,6 +6,7 @@ import shutil
 from collections import defaultdict
 
 from mako.lookup import TemplateLookup
+from mako.runtime import Context
 from mako.template import Template
 
 from obidog.bindings.generator import discard_placeholders
@@ -20,7 +22,6 @@ from obidog.models.bindings import LuaType
 from obidog.models.classes import AttributeModel, ClassModel
 from obidog.models.functions import FunctionModel
 from obidog.models.namespace import NamespaceModel
-from obidog.models.qualifiers import QualifiersModel
 from obidog.utils.cpp_utils import make_fqn
 
 # TODO: rename p0, p1, p2 to proper parameter names
@@ -29,95 +30,149 @@ from obidog.utils.cpp_utils import make_fqn
 BindableElement = ClassModel | NamespaceModel | FunctionModel | AttributeModel
 
 EVENT_NAMESPACE = "events"
+# Same order as CppDatabase attributes, which drives the order of rendered hints
+CPP_DB_CATEGORIES = (
+    "classes",
+    "typedefs",
+    "functions",
+    "globals",
+    "enums",
+    "namespaces",
+)
+HINTS_WRITE_BUFFER_SIZE = 1 << 20
+HINTS_HEADER = "---@meta\n\n"
+HINTS_TEMPLATES_DIRECTORY = os.path.join("templates", "hints")
+HINTS_TEMPLATES = {
+    "class": "lua_class.mako",
+    "function": "lua_function.mako",
+    "enum": "lua_enum.mako",
+    "global": "lua_global.mako",
+    "typedef": "lua_typedef.mako",
+}
+OPERATOR_REGEX = re.compile(r"^operator\W")
+# Extracts the event id from an initializer such as ' = "Loaded"'
+EVENT_ID_REGEX = re.compile(r'\s*=?\s*"?(.*?)"?\s*\Z', re.S)
+
+
+@functools.lru_cache(maxsize=None)
+def _dotted(cpp_namespace: str) -> str:
+    return cpp_namespace.replace("::", ".")
+
+
+@functools.lru_cache(maxsize=None)
+def _load_template(path: str, lookup_directories: tuple[str, ...]) -> Template:
+    lookup = TemplateLookup(list(lookup_directories))
+    with open(path, "r", encoding="utf-8") as tpl:
+        return Template(tpl.read(), lookup=lookup)
 
 
 def write_hints(
     elements_by_namespace: dict[str, list[BindableElement]],
 ):
-    lookup = TemplateLookup(["templates/hints"])
     export_directory = os.path.join(PATH_TO_OBENGINE, "engine", "Hints")
 
-    # Load hints templates
-    templates = {}
-    with open("templates/hints/lua_class.mako", "r", encoding="utf-8") as tpl:
-        templates["class"] = Template(tpl.read(), lookup=lookup)
-    with open("templates/hints/lua_function.mako", "r", encoding="utf-8") as tpl:
-        templates["function"] = Template(tpl.read(), lookup=lookup)
-    with open("templates/hints/lua_enum.mako", "r", encoding="utf-8") as tpl:
-        templates["enum"] = Template(tpl.read(), lookup=lookup)
-    with open("templates/hints/lua_global.mako", "r", encoding="utf-8") as tpl:
-        templates["global"] = Template(tpl.read(), lookup=lookup)
-    with open("templates/hints/lua_typedef.mako", "r", encoding="utf-8") as tpl:
-        templates["typedef"] = Template(tpl.read(), lookup=lookup)
-
-    # Build hint list for each namespace
-    hints_by_namespace = {namespace: [] for namespace in elements_by_namespace}
-
-    # Add initial table declaration on top of each namespace
-    for namespace, hints in hints_by_namespace.items():
-        hints.append("---@meta\n\n")
-        if namespace:
-            hints.append(f"{namespace} = {{}};\n")
-
-    # Render all hints
-    for namespace, elements in elements_by_namespace.items():
-        for element in elements:
-            if element._type in templates:
-                element_tpl = templates[element._type]
-                rendered_element = element_tpl.get_def("render").render(element=element)
-                hints_by_namespace[namespace].append(rendered_element)
+    # Load hints templates (compiled once per process)
+    templates = {
+        element_type: _load_template(
+            os.path.join(HINTS_TEMPLATES_DIRECTORY, template_filename),
+            (HINTS_TEMPLATES_DIRECTORY,),
+        )
+        for element_type, template_filename in HINTS_TEMPLATES.items()
+    }
 
-    # Add "return" statement at end of module
-    for namespace, hints in hints_by_namespace.items():
-        if namespace:
-            hints.append(f"return {namespace};")
+    # Resolve each template's render def once instead of once per element
+    render_defs = {
+        element_type: template.get_def("render")
+        for element_type, template in templates.items()
+    }
 
     # Copy custom hints to export folder
     for custom_hint_filename in glob.glob(os.path.join("hints", "*.*")):
         shutil.copy(custom_hint_filename, export_directory)
 
-    for namespace, hints in hints_by_namespace.items():
+    # Stream each namespace straight to its hints file
+    for namespace, elements in elements_by_namespace.items():
         namespace_name = namespace if namespace else "_root"
         with open(
             os.path.join(export_directory, f"{namespace_name}.lua"),
             "w",
             encoding="utf-8",
+            buffering=HINTS_WRITE_BUFFER_SIZE,
         ) as export:
-            export.write("".join(hints))
+            # Add initial table declaration on top of each namespace
+            export.write(
+                f"{HINTS_HEADER}{namespace} = {{}};\n" if namespace else HINTS_HEADER
+            )
 
+            # A single context per file, so template namespaces (utils, ...)
+            # are only set up once and output goes straight to the file
+            context = Context(export)
+            for element in elements:
+                render_def = render_defs.get(element._type)
+                if render_def is not None:
+                    render_def.render_context(context, element=element)
 
-def _add_return_type_to_constructors(cpp_db: CppDatabase):
+            # Add "return" statement at end of module
+            if namespace:
+                export.write(f"return {namespace};")
+
+
+def _prepare_classes(cpp_db: CppDatabase) -> dict[str, list[ClassModel]]:
+    """Prepares all classes for hints generation in a single pass over the database
+
+    Adds return types to constructors, removes operators and turns
+    "as_property" methods into attributes
+
+    Returns the classes living in sub-namespaces of each two-level namespace,
+    indexed by that namespace (e.g. "obe::events" for "obe::events::Scene::Loaded")
+    """
+    classes_by_namespace_root = defaultdict(list)
     for class_value in cpp_db.classes.values():
+        lua_class_name = f"{_dotted(class_value.namespace)}.{class_value.name}"
         for constructor in class_value.constructors:
-            lua_class_name = (
-                f"{class_value.namespace.replace('::', '.')}.{class_value.name}"
-            )
             constructor.return_type = LuaType(type=lua_class_name)
             if not constructor.description:
                 constructor.description = f"{lua_class_name} constructor"
 
-
-def _remove_operators(cpp_db: CppDatabase):
-    for class_value in cpp_db.classes.values():
-        operators_to_pop = []
+        methods = {}
         for method_name, method in class_value.methods.items():
-            if re.search(r"^operator\W", method.name):
-                operators_to_pop.append(method_name)
-        for method_name in operators_to_pop:
-            class_value.methods.pop(method_name)
+            if OPERATOR_REGEX.match(method.name):
+                continue
+            if not method.flags.as_property:
+                methods[method_name] = method
+                continue
+            # Methods are renamed later on, attributes must use their final name
+            attribute_name = method.flags.rename or method.name
+            class_value.attributes[attribute_name] = AttributeModel(
+                name=attribute_name,
+                namespace=method.namespace,
+                from_class="?",
+                type=method.return_type,
+                qualifiers=method.qualifiers,
+                description=method.description or "",
+                flags=method.flags,
+                export=method.export,
+                location=method.location,
+                visibility=method.visibility,
+                urls=method.urls,
+            )
+        class_value.methods = methods
+
+        namespace_parts = class_value.namespace.split("::", 2)
+        if len(namespace_parts) == 3:
+            namespace_root = "::".join(namespace_parts[:2])
+            classes_by_namespace_root[namespace_root].append(class_value)
+
+    return classes_by_namespace_root
 
 
 def _get_namespace_tables(elements):
     return sorted(
-        list(
-            set(
-                [
-                    element.namespace.replace("::", ".")
-                    for element in elements
-                    if hasattr(element, "namespace") and element.namespace
-                ]
-            )
-        ),
+        {
+            _dotted(element.namespace)
+            for element in elements
+            if getattr(element, "namespace", "")
+        },
         key=lambda s: s.count("."),
     )
 
@@ -131,107 +186,78 @@ def _group_elements_by_namespace(elements):
     for element in elements:
         dotted_namespace = ""
         if hasattr(element, "namespace") and element.namespace:
-            dotted_namespace = element.namespace.replace("::", ".")
+            dotted_namespace = _dotted(element.namespace)
         elements_by_namespace[dotted_namespace].append(element)
 
     return elements_by_namespace
 
 
 def _fix_bind_as(elements: list[FunctionModel | ClassModel | AttributeModel]):
-    for element in elements:
-        if element.flags.rename:
-            element.name = element.flags.rename
+    elements_to_visit = list(elements)
+    visited = set()
+    while elements_to_visit:
+        element = elements_to_visit.pop()
+        if id(element) in visited:
+            continue
+        visited.add(id(element))
+        rename = element.flags.rename
+        if rename:
+            element.name = rename
             if element._type == "overload":
                 for overload in element.overloads:
-                    overload.name = element.flags.rename
+                    overload.name = rename
         if isinstance(element, ClassModel):
-            _fix_bind_as(element.methods.values())
-            _fix_bind_as(element.attributes.values())
+            elements_to_visit.extend(element.methods.values())
+            elements_to_visit.extend(element.attributes.values())
 
 
-def _setup_methods_as_attributes(classes: dict[str, ClassModel]):
-    for class_value in classes.values():
-        methods_to_pop = []
-        for method_name, method in class_value.methods.items():
-            if method.flags.as_property:
-                methods_to_pop.append(method_name)
-                class_value.attributes[method.name] = AttributeModel(
-                    name=method.name,
-                    namespace=method.namespace,
-                    from_class="?",
-                    type=method.return_type,
-                    qualifiers=QualifiersModel(
-                        const=method.qualifiers.const, static=method.qualifiers.static
-                    ),
-                    description=method.description or "",
-                    flags=method.flags,
-                    export=method.export,
-                    location=method.location,
-                    visibility=method.visibility,
-                    urls=method.urls,
-                )
-        for method in methods_to_pop:
-            class_value.methods.pop(method)
-
-def _get_events_grouped_by_section(classes: dict[str, ClassModel]) -> dict[str, list[AttributeModel]]:
-    event_classes: list[ClassModel] = []
-    for class_value in classes.values():
-        if class_value.namespace.startswith(f"obe::{EVENT_NAMESPACE}::"):
-            event_classes.append(class_value)
-    events_grouped_by_section = defaultdict(list)
+def _iter_events(event_classes: list[ClassModel]):
+    """Yields (section, event_id, event) for each event class that has an id"""
     for event in event_classes:
         if "id" not in event.attributes:
             continue
         event_initializer = event.attributes["id"].initializer or ""
-        event_id = (
-            event_initializer.strip()
-            .removeprefix("=")
-            .strip()
-            .removeprefix('"')
-            .removesuffix('"')
+        event_id = EVENT_ID_REGEX.match(event_initializer).group(1)
+        yield (
+            event.namespace.removeprefix(f"obe::{EVENT_NAMESPACE}::"),
+            event_id,
+            event,
         )
-        events_grouped_by_section[
-            event.namespace.removeprefix(f"obe::{EVENT_NAMESPACE}::")
-        ].append((event_id, event))
 
-    return events_grouped_by_section
 
-
-def _build_table_for_events(classes: dict[str, ClassModel], table_target: tuple[str] = ("obe", EVENT_NAMESPACE)):
+def _build_table_for_events(event_classes: list[ClassModel], table_target: tuple[str] = ("obe", EVENT_NAMESPACE)):
     result = {}
     target_cpp_namespace = "::".join(table_target)
     target_lua_namespace = ".".join(table_target)
+    event_groups_namespace = f"{target_cpp_namespace}::_EventTableGroups"
 
-    events_grouped_by_section = _get_events_grouped_by_section(classes)
     event_groups = {}
-    for event_group_name, events in events_grouped_by_section.items():
-        event_group_attributes = {
-            event_id: AttributeModel(
-                name=event_id,
+    event_groups_as_attributes = {}
+    for event_group_name, event_id, event in _iter_events(event_classes):
+        event_group = event_groups.get(event_group_name)
+        if event_group is None:
+            event_group = event_groups[event_group_name] = ClassModel(
+                name=event_group_name,
+                namespace=event_groups_namespace,
+                attributes={},
+                constructors=[],
+                methods={},
+            )
+            event_groups_as_attributes[event_group_name] = AttributeModel(
+                name=event_group_name,
                 from_class="?",
-                type=LuaType(type=f"fun(evt:{target_lua_namespace}.{event_group_name}.{event.name})"),
-                namespace=event.namespace,
+                namespace=event_groups_namespace,
+                type=LuaType(type=f"{target_lua_namespace}._EventTableGroups.{event_group_name}"),
             )
-            for event_id, event in events
-        }
-        event_groups[event_group_name] = ClassModel(
-            name=event_group_name,
-            namespace=f"{target_cpp_namespace}::_EventTableGroups",
-            attributes=event_group_attributes,
-            constructors=[],
-            methods={},
-        )
-
-    event_groups_as_attributes = {}
-    for event_group_name, event_group in event_groups.items():
-        event_groups_as_attributes[event_group_name] = AttributeModel(
-            name=event_group.name,
+            result[f"{event_groups_namespace}::{event_group_name}"] = event_group
+        event_group.attributes[event_id] = AttributeModel(
+            name=event_id,
             from_class="?",
-            namespace=event_group.namespace,
-            type=LuaType(type=f"{target_lua_namespace}._EventTableGroups.{event_group_name}"),
+            type=LuaType(type=f"fun(evt:{target_lua_namespace}.{event_group_name}.{event.name})"),
+            namespace=event.namespace,
         )
 
-    event_namespace = ClassModel(
+    result[f"{target_cpp_namespace}::_EventTable"] = ClassModel(
         name="_EventTable",
         namespace=target_cpp_namespace,
         attributes=event_groups_as_attributes,
@@ -239,48 +265,42 @@ def _build_table_for_events(classes: dict[str, ClassModel], table_target: tuple[
         methods={},
     )
 
-    for event_group_name, event_group in event_groups.items():
-        result[f"{event_group.namespace}::{event_group.name}"] = event_group
-    result[f"{target_cpp_namespace}::_EventTable"] = event_namespace
-
     return result
 
 # Copy of function above, but inject GameObjectCls as first parameter (so it acts as methods instead of free functions)
-def _build_table_for_gameobject_events(classes: dict[str, ClassModel], table_target: tuple[str] = ("obe", EVENT_NAMESPACE)):
+def _build_table_for_gameobject_events(event_classes: list[ClassModel], table_target: tuple[str] = ("obe", EVENT_NAMESPACE)):
     result = {}
     target_cpp_namespace = "::".join(table_target)
     target_lua_namespace = ".".join(table_target)
+    event_groups_namespace = f"{target_cpp_namespace}::_GameObjectEventTableGroups"
 
-    events_grouped_by_section = _get_events_grouped_by_section(classes)
     event_groups = {}
-    for event_group_name, events in events_grouped_by_section.items():
-        event_group_attributes = {
-            event_id: AttributeModel(
-                name=event_id,
+    event_groups_as_attributes = {}
+    for event_group_name, event_id, event in _iter_events(event_classes):
+        event_group = event_groups.get(event_group_name)
+        if event_group is None:
+            event_group = event_groups[event_group_name] = ClassModel(
+                name=event_group_name,
+                namespace=event_groups_namespace,
+                attributes={},
+                constructors=[],
+                methods={},
+            )
+            event_groups_as_attributes[event_group_name] = AttributeModel(
+                name=event_group_name,
                 from_class="?",
-                type=LuaType(type=f"fun(self: GameObjectCls, evt:{target_lua_namespace}.{event_group_name}.{event.name})"),
-                namespace=event.namespace,
+                namespace=event_groups_namespace,
+                type=LuaType(type=f"{target_lua_namespace}._GameObjectEventTableGroups.{event_group_name}"),
             )
-            for event_id, event in events
-        }
-        event_groups[event_group_name] = ClassModel(
-            name=event_group_name,
-            namespace=f"{target_cpp_namespace}::_GameObjectEventTableGroups",
-            attributes=event_group_attributes,
-            constructors=[],
-            methods={},
-        )
-
-    event_groups_as_attributes = {}
-    for event_group_name, event_group in event_groups.items():
-        event_groups_as_attributes[event_group_name] = AttributeModel(
-            name=event_group.name,
+            result[f"{event_groups_namespace}::{event_group_name}"] = event_group
+        event_group.attributes[event_id] = AttributeModel(
+            name=event_id,
             from_class="?",
-            namespace=event_group.namespace,
-            type=LuaType(type=f"{target_lua_namespace}._GameObjectEventTableGroups.{event_group_name}"),
+            type=LuaType(type=f"fun(self: GameObjectCls, evt:{target_lua_namespace}.{event_group_name}.{event.name})"),
+            namespace=event.namespace,
         )
 
-    event_namespace = ClassModel(
+    result[f"{target_cpp_namespace}::_GameObjectEventTable"] = ClassModel(
         name="_GameObjectEventTable",
         namespace=target_cpp_namespace,
         attributes=event_groups_as_attributes,
@@ -288,26 +308,23 @@ def _build_table_for_gameobject_events(classes: dict[str, ClassModel], table_tar
         methods={},
     )
 
-    for event_group_name, event_group in event_groups.items():
-        result[f"{event_group.namespace}::{event_group.name}"] = event_group
-    result[f"{target_cpp_namespace}::_GameObjectEventTable"] = event_namespace
-
     return result
 
 def _generate_dynamic_tuple(
     tuple_name: str, tuple_type: DynamicTupleType
 ) -> ClassModel:
+    attribute_names = [f"[{i}]" for i in range(len(tuple_type.sub_types))]
     return ClassModel(
         name=tuple_name,
         namespace="",
         attributes={
-            f"[{i}]": AttributeModel(
-                name=f"[{i}]",
+            attribute_name: AttributeModel(
+                name=attribute_name,
                 from_class="?",
                 type=sub_type,
                 namespace="",
             )
-            for i, sub_type in enumerate(tuple_type.sub_types)
+            for attribute_name, sub_type in zip(attribute_names, tuple_type.sub_types)
         },
         constructors=[],
         methods={},
@@ -331,21 +348,21 @@ def generate_hints(cpp_db: CppDatabase):
     log.info("Converting all types")
     convert_all_types(cpp_db)
 
-    cpp_db.classes |= _build_table_for_events(cpp_db.classes)
-    cpp_db.classes |= _build_table_for_gameobject_events(cpp_db.classes)
-    cpp_db.classes |= _generate_dynamic_types()
+    classes_by_namespace_root = _prepare_classes(cpp_db)
+    event_classes = classes_by_namespace_root.get(f"obe::{EVENT_NAMESPACE}", [])
+
+    generated_classes = _build_table_for_events(event_classes)
+    generated_classes.update(_build_table_for_gameobject_events(event_classes))
+    generated_classes.update(_generate_dynamic_types())
+    cpp_db.classes.update(generated_classes)
     all_elements = [
         item
-        for item_type in cpp_db.__dict__.keys()
+        for item_type in CPP_DB_CATEGORIES
         for item in getattr(cpp_db, item_type).values()
         if not item.flags.nobind
     ]
 
-    _add_return_type_to_constructors(cpp_db)
-    _remove_operators(cpp_db)
-
     _fix_bind_as(all_elements)
-    _setup_methods_as_attributes(cpp_db.classes)
 
     log.info("Generating hints")
     write_hints(_group_elements_by_namespace(all_elements))
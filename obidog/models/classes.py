@@ -20,7 +20,7 @@ class AttributeModel(CppElement):
     from_class: str
     qualifiers: QualifiersModel = Field(default_factory=QualifiersModel)
     description: str = ""
-    initializer: str | None
+    initializer: str | None = None
     flags: ObidogFlagsModel = Field(default_factory=ObidogFlagsModel)
     export: Export = Field(default_factory=Export)
     location: Location = Field(default_factory=Location)